@@ -0,0 +1,71 @@
+import asyncio
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+
+
+class ResourceCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: Upper bound on the total size of cached content, in bytes
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+
+        self._entries: OrderedDict[tuple[int, str], dict] = OrderedDict()
+        self._pending: dict[tuple[int, str], asyncio.Event] = {}
+
+    async def get(self, key: tuple[int, str], loader: Callable[[], Awaitable[dict | None]]) -> dict | None:
+        """
+        Return the cached row for key, calling loader() on a miss.
+
+        Args:
+            key: (job_id, absolute_url) of the archived resource
+            loader: Coroutine factory that fetches the row from the database
+
+        Concurrent misses for the same key wait on the first caller's load instead of
+        each hitting the database. Rows that aren't found are not cached, since the
+        job may still be crawling.
+        """
+        while True:
+            row = self._entries.get(key)
+            if row is not None:
+                self._entries.move_to_end(key)
+                return row
+
+            event = self._pending.get(key)
+            if event is None:
+                break
+            await event.wait()
+
+        event = self._pending[key] = asyncio.Event()
+        try:
+            row = await loader()
+            if row is not None:
+                self._store(key, row)
+            return row
+        finally:
+            del self._pending[key]
+            event.set()
+
+    def clear(self) -> None:
+        """Drop every cached row."""
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def _store(self, key: tuple[int, str], row: dict) -> None:
+        size = len(row['content'] or b'')
+        if size > self.max_bytes:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= len(old['content'] or b'')
+
+        self._entries[key] = row
+        self.total_bytes += size
+
+        # Evict least recently used rows until we're back under the cap
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= len(evicted['content'] or b'')
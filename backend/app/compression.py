@@ -0,0 +1,79 @@
+import asyncio
+import gzip
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Content types worth compressing. Everything else we serve (images, video, fonts, archives) is
+# already compressed, so gzipping it again only burns CPU and copies the body
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+# Bodies at least this large are compressed on a worker thread instead of the event loop
+THREAD_MIN_BYTES = 128 * 1024
+
+
+class TextGZipMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, compresslevel: int = 6):
+        """
+        Gzip responses with a compressible content type for clients that accept it.
+
+        Args:
+            app: ASGI app to wrap
+            minimum_size: Smallest body, in bytes, that is worth compressing
+            compresslevel: zlib compression level
+
+        Only complete single-message bodies are compressed; streamed, partial or
+        already-encoded responses pass through untouched.
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.compresslevel = compresslevel
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or 'gzip' not in Headers(scope=scope).get('accept-encoding', ''):
+            await self.app(scope, receive, send)
+            return
+
+        # http.response.start held back until we know whether the body gets compressed
+        pending: Message | None = None
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal pending
+
+            if message['type'] == 'http.response.start':
+                headers = Headers(raw=message['headers'])
+                ctype = headers.get('content-type', '').lower()
+                if (
+                    'content-encoding' in headers
+                    or message['status'] == 206
+                    or not ctype.startswith(COMPRESSIBLE_TYPES)
+                ):
+                    await send(message)
+                else:
+                    MutableHeaders(raw=message['headers']).add_vary_header('Accept-Encoding')
+                    pending = message
+                return
+
+            if pending is None or message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            start, pending = pending, None
+            body = message.get('body', b'')
+            if message.get('more_body', False) or len(body) < self.minimum_size:
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) >= THREAD_MIN_BYTES:
+                body = await asyncio.to_thread(gzip.compress, body, self.compresslevel)
+            else:
+                body = gzip.compress(body, self.compresslevel)
+
+            headers = MutableHeaders(raw=start['headers'])
+            headers['Content-Encoding'] = 'gzip'
+            headers['Content-Length'] = str(len(body))
+            await send(start)
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, receive, send_compressed)
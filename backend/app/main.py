@@ -1,18 +1,23 @@
 import os
 import re
 import asyncio
+import logging
+from html import unescape
 from pathlib import Path
+from functools import lru_cache, partial
 from datetime import datetime, timezone
 from contextlib import asynccontextmanager
-from urllib.parse import urlsplit, urlunsplit, quote, unquote
+from urllib.parse import urlsplit, urlunsplit, quote_from_bytes, unquote
 
 from psycopg_pool import AsyncConnectionPool
 from psycopg.rows import dict_row
-from bs4 import BeautifulSoup
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response
+from pydantic import TypeAdapter
 
+from app.cache import ResourceCache
+from app.compression import TextGZipMiddleware
 from app.schemas import ArchiveRequest, ArchivedSite, ArchiveJob, ArchivedPage
 from archiver import BasicArchiver
 
@@ -21,9 +26,39 @@ SQL_DIR = Path(__file__).parent / 'sql'
 SQL_GET_ARCHIVED_SITES = (SQL_DIR / 'get_archived_sites.sql').read_text(encoding='utf-8')
 SQL_GET_SITE_JOBS = (SQL_DIR / 'get_site_jobs.sql').read_text(encoding='utf-8')
 SQL_GET_JOB_PAGES = (SQL_DIR / 'get_job_pages.sql').read_text(encoding='utf-8')
-SQL_DEBUG_QUERY = (SQL_DIR / 'debug_available_url.sql').read_text(encoding='utf-8')
 SQL_FETCH_CONTENT = (SQL_DIR / 'get_content.sql').read_text(encoding='utf-8')
 
+# Start-tag attributes. Quoted values may contain '>', but nothing may cross a '<', so a tag with an
+# unterminated quote stops failing at the next tag instead of rescanning the rest of the document
+_TAG_ATTRS = rb"""((?:[^<>"']|"[^<"]*"|'[^<']*')*)"""
+# Spans of a page the link rewriter looks at, in order of precedence:
+# comments and <script>/<style> bodies are matched whole so markup-like text inside them
+# (e.g. JS building '<img src="' + url + '">') is never touched, then link-bearing start tags
+HTML_TOKEN_RE = re.compile(
+    rb'<!--.*?(?:-->|\Z)'
+    rb'|<(script|style)\b' + _TAG_ATTRS + rb'>.*?(?:</\1\s*>|\Z)'
+    rb'|<(a|link|img)\b' + _TAG_ATTRS + rb'>',
+    re.IGNORECASE | re.DOTALL,
+)
+# One name[=value] attribute pair. Matching whole pairs means text like ' href=' inside another
+# attribute's quoted value is consumed as part of that value, never mistaken for an attribute
+ATTR_RE = re.compile(rb"""([^\s"'>/=]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?""")
+
+# Attribute values that never point at an archived resource
+SKIP_URL_PREFIXES = ('#', 'data:', 'mailto:', 'javascript:')
+
+# Wayback URL modifiers by resource kind
+WB_MODIFIERS = {'': '', 'image': 'im_', 'css': 'cs_', 'js': 'js_'}
+
+# Wayback timestamps
+TS14_RE = re.compile(r'\d{14}')
+NON_DIGIT_RE = re.compile(r'\D')
+
+# Serializes listing rows (lists of dicts) to JSON bytes
+ROWS_ADAPTER = TypeAdapter(list[dict])
+
+logger = logging.getLogger(__name__)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -47,114 +82,176 @@ app.add_middleware(
     allow_headers=['*'],
 )
 
+# Compress archived HTML/CSS/JS and JSON listings for clients that accept gzip (already-compressed media is left alone)
+app.add_middleware(TextGZipMiddleware, minimum_size=1024, compresslevel=6)
+
 # Database connection
 PG_URI = os.environ['PG_URI']
-pool = AsyncConnectionPool(PG_URI, open=False)
+# prepare_threshold=0 makes every connection prepare each statement on first execution, so the
+# queries loaded from sql/ are parsed and planned once per connection instead of on every request.
+# Every cursor returns dict rows.
+pool = AsyncConnectionPool(
+    PG_URI,
+    min_size=10,
+    max_size=50,
+    max_idle=300,
+    open=False,
+    kwargs={'prepare_threshold': 0, 'row_factory': dict_row},
+)
 
+# Running archive jobs; holding a reference keeps the tasks from being garbage collected mid-crawl
+background_tasks: set[asyncio.Task] = set()
 
+# Recently served archived resources, keyed on (job_id, absolute_url)
+RESOURCE_CACHE_MAX_BYTES = int(os.environ.get('RESOURCE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+resource_cache = ResourceCache(max_bytes=RESOURCE_CACHE_MAX_BYTES)
+
+
+@lru_cache(maxsize=256)
 def _wb_ts_from_iso(dt_str: str) -> str:
     """Convert ISO datetime string to 14-digit Wayback timestamp."""
-    if re.fullmatch(r'\d{14}', dt_str):
+    if TS14_RE.fullmatch(dt_str):
         return dt_str
     try:
         d = datetime.fromisoformat(dt_str.replace('Z', '+00:00')).astimezone(timezone.utc)
         return d.strftime('%Y%m%d%H%M%S')
     except Exception:
-        digits = re.sub(r'\D', '', dt_str)
+        digits = NON_DIGIT_RE.sub('', dt_str)
         return (digits + '00000000000000')[:14]
 
 
+@lru_cache(maxsize=256)
 def _wb_ts_to_iso(ts14: str) -> str:
     """Convert 14-digit Wayback timestamp to ISO datetime."""
     dt = datetime.strptime(ts14, '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
     return dt.isoformat()
 
 
+@lru_cache(maxsize=4096)
 def _abs_url(base_host: str, val: str) -> str | None:
     """Convert relative URLs to absolute URLs for the same host."""
-    if not val or val.startswith(('#', 'data:', 'mailto:', 'javascript:')):
+    if not val or val.startswith(SKIP_URL_PREFIXES):
         return None
 
     if val.startswith('//'):
-        parsed = urlsplit('https:' + val)
+        absu = 'https:' + val
     elif val.startswith(('http://', 'https://')):
-        parsed = urlsplit(val)
+        absu = val
+    elif val[0] == '/':
+        absu = f'https://{base_host}{val}'
     else:
-        if val.startswith('/'):
-            absu = f'https://{base_host}{val}'
-        else:
-            absu = f'https://{base_host}/{val}'
-        parsed = urlsplit(absu)
+        absu = f'https://{base_host}/{val}'
+
+    # Fast path: the authority is exactly our host and there's nothing urlsplit/urlunsplit would normalize
+    # (tabs/newlines, an empty query or fragment), so the URL is already in its final form.
+    authority = absu[absu.index('//') + 2 :].partition('/')[0].partition('?')[0].partition('#')[0]
+    if authority == base_host and absu.isprintable() and '?#' not in absu and absu[-1] not in '?#':
+        return absu
 
+    parsed = urlsplit(absu)
     if parsed.hostname != base_host:
         return None
 
     return urlunsplit(parsed)
 
 
-def _wb_path(job_id: int, full_url: str, kind: str = '') -> str:
-    """Build Wayback-style path: /web/{job_id}{modifier}/{encoded_url}"""
-    mod = ''
-    if kind == 'image':
-        mod = 'im_'
-    elif kind == 'css':
-        mod = 'cs_'
-    elif kind == 'js':
-        mod = 'js_'
+@lru_cache(maxsize=4096)
+def _encode_url(full_url: str) -> bytes:
+    """Percent-encode an absolute URL for use as the last segment of a Wayback-style path."""
+    return quote_from_bytes(full_url.encode('utf-8'), safe='').encode('ascii')
 
-    enc = quote(full_url, safe='')
-    return f'/api/web/{job_id}{mod}/{enc}'
 
+def rewrite_links_in_html(html_content: bytes, original_host: str, job_id: int) -> bytes:
+    """
+    Rewrite HTML links to point to archived versions.
 
-def rewrite_links_in_html(html_content: str, original_host: str, job_id: int) -> str:
-    """Rewrite HTML links to point to archived versions."""
-    soup = BeautifulSoup(html_content, 'html.parser')
-
-    # Rewrite href attributes
-    for tag in soup.find_all(['a', 'link'], href=True):
-        href = tag['href']
-        absu = _abs_url(original_host, href)
+    Works on the raw page bytes, so the document is never decoded or re-encoded as a whole;
+    only the matched attribute values are decoded to resolve them.
+    """
+    # Wayback-style path prefixes for this job: /api/web/{job_id}{modifier}/
+    prefixes = {kind: f'/api/web/{job_id}{mod}/'.encode('ascii') for kind, mod in WB_MODIFIERS.items()}
+
+    def rewrite_token(m: re.Match) -> bytes:
+        if m.group(3):
+            return rewrite_tag(m.group(3), m.group(4)) or m.group(0)
+        if m.group(1) and m.group(1).lower() == b'script':
+            # Only the start tag; the script body after it is left as is
+            tag = rewrite_tag(m.group(1), m.group(2))
+            if tag:
+                return tag + m.group(0)[m.end(2) + 1 - m.start() :]
+        # Comment, <style> block, or nothing to rewrite
+        return m.group(0)
+
+    def rewrite_tag(tag: bytes, attrs: bytes) -> bytes | None:
+        """Return the start tag with its link pointed at the archive, or None to keep it unchanged."""
+        name = tag.lower()
+        target = b'href' if name in (b'a', b'link') else b'src'
+
+        # First occurrence of each attribute wins, as in browsers
+        attr_m = rel_m = None
+        for pair in ATTR_RE.finditer(attrs):
+            attr_name = pair.group(1).lower()
+            if attr_name == target and attr_m is None:
+                attr_m = pair
+            elif attr_name == b'rel' and rel_m is None:
+                rel_m = pair
+        if not attr_m or attr_m.group(2) is None:
+            return None
+
+        raw_val = attr_m.group(2)
+        q = raw_val[:1] if raw_val[:1] in (b'"', b"'") else b''
+        val = (raw_val[1:-1] if q else raw_val).decode('utf-8', errors='ignore')
+        absu = _abs_url(original_host, unescape(val))
         if not absu:
-            continue
+            return None
 
         kind = ''
-        if tag.name == 'link':
-            rels = set((tag.get('rel') or []))
-            if 'stylesheet' in rels:
+        if name == b'link':
+            rels = set(rel_m.group(2).strip(b'"\'').lower().split()) if rel_m and rel_m.group(2) else set()
+            if b'stylesheet' in rels:
                 kind = 'css'
-            elif 'icon' in rels or 'apple-touch-icon' in rels:
+            elif b'icon' in rels or b'apple-touch-icon' in rels:
                 kind = 'image'
+        elif name == b'img':
+            kind = 'image'
+        elif name == b'script':
+            kind = 'js'
 
-        tag['href'] = _wb_path(job_id, absu, kind)
-
-    # Rewrite src attributes
-    for tag in soup.find_all(['img', 'script'], src=True):
-        src = tag['src']
-        absu = _abs_url(original_host, src)
-        if not absu:
-            continue
-        kind = 'image' if tag.name == 'img' else 'js'
-        tag['src'] = _wb_path(job_id, absu, kind)
+        q = q or b'"'
+        new_val = q + prefixes[kind] + _encode_url(absu) + q
+        return b'<' + tag + attrs[: attr_m.start(2)] + new_val + attrs[attr_m.end(2) :] + b'>'
 
-    return str(soup)
+    return HTML_TOKEN_RE.sub(rewrite_token, html_content)
 
 
 async def _fetch_from_db(job_id: int, absolute_url: str):
-    """Fetch archived resource from database by job ID."""
+    """Fetch archived resource by job ID, serving repeat requests from the in-process cache."""
+    return await resource_cache.get((job_id, absolute_url), partial(_query_content, job_id, absolute_url))
+
+
+async def _query_content(job_id: int, absolute_url: str):
+    """
+    Fetch archived resource from database by job ID.
+
+    Results come back in binary format, so the bytea content arrives as raw bytes
+    instead of hex text that has to be decoded.
+    """
     async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute(SQL_FETCH_CONTENT, {'job_id': job_id, 'link': absolute_url})
+        async with conn.cursor() as cur:
+            await cur.execute(SQL_FETCH_CONTENT, {'job_id': job_id, 'link': absolute_url}, binary=True)
             return await cur.fetchone()
 
 
-def _normalize_bytes(raw):
-    """Convert various byte formats to bytes."""
+def _normalize_bytes(raw) -> bytes | memoryview:
+    """
+    Convert various byte formats to something a Response can send.
+
+    bytes and memoryview are returned as-is, so large assets aren't copied before being written out.
+    """
     if raw is None:
         return b''
-    if isinstance(raw, memoryview):
-        return raw.tobytes()
-    if isinstance(raw, (bytearray, bytes)):
-        return bytes(raw)
+    if isinstance(raw, (bytes, memoryview)):
+        return raw
     return bytes(raw)
 
 
@@ -176,73 +273,66 @@ def _normalize_absolute(u: str) -> str:
     return u
 
 
+def _rows_response(rows: list[dict]) -> Response:
+    """
+    Serialize query rows straight to JSON.
+
+    The listing queries select exactly the columns of their response model, so building and validating a model
+    per row is skipped. response_model is still declared on the routes for the OpenAPI schema.
+    """
+    return Response(content=ROWS_ADAPTER.dump_json(rows), media_type='application/json')
+
+
 @app.get('/archived-sites', response_model=list[ArchivedSite])
-async def get_archived_sites():
+async def get_archived_sites(limit: int | None = Query(None, ge=1, le=10000), offset: int = Query(0, ge=0)):
     """Get all archived sites with their latest archive job."""
     async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute(SQL_GET_ARCHIVED_SITES)
+        async with conn.cursor() as cur:
+            await cur.execute(SQL_GET_ARCHIVED_SITES, {'limit': limit, 'offset': offset})
             rows = await cur.fetchall()
-            return [
-                ArchivedSite(
-                    host=row['host'],
-                    latest_job_time=row['latest_job_time'],
-                    page_count=row['page_count'],
-                    job_count=row['job_count'],
-                )
-                for row in rows
-            ]
+            return _rows_response(rows)
 
 
 @app.get('/archived-sites/{host}/jobs', response_model=list[ArchiveJob])
-async def get_site_jobs(host: str):
+async def get_site_jobs(host: str, limit: int | None = Query(None, ge=1, le=10000), offset: int = Query(0, ge=0)):
     """Get all archive jobs for a specific host."""
     async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute(SQL_GET_SITE_JOBS, {'host': host, 'ctx_type': 'text/html%'})
+        async with conn.cursor() as cur:
+            await cur.execute(SQL_GET_SITE_JOBS, {'host': host, 'limit': limit, 'offset': offset})
             rows = await cur.fetchall()
-            return [
-                ArchiveJob(
-                    id=row['id'],
-                    time_started=row['time_started'],
-                    page_count=row['page_count'],
-                )
-                for row in rows
-            ]
+            return _rows_response(rows)
 
 
 @app.get('/archived-sites/{host}/jobs/{job_id}/pages', response_model=list[ArchivedPage])
-async def get_job_pages(host: str, job_id: int):
+async def get_job_pages(
+    host: str, job_id: int, limit: int | None = Query(None, ge=1, le=10000), offset: int = Query(0, ge=0)
+):
     """Get all archived pages for a specific job."""
     async with pool.connection() as conn:
-        async with conn.cursor(row_factory=dict_row) as cur:
-            await cur.execute(SQL_GET_JOB_PAGES, {'host': host, 'job_id': job_id, 'ctx_type': 'text/html%'})
+        async with conn.cursor() as cur:
+            await cur.execute(SQL_GET_JOB_PAGES, {'host': host, 'job_id': job_id, 'limit': limit, 'offset': offset})
             rows = await cur.fetchall()
-            return [
-                ArchivedPage(
-                    id=row['id'],
-                    link=row['link'],
-                    host=row['host'],
-                    status_code=row['status_code'],
-                    content_type=row['content_type'],
-                    content_length=row['content_length'],
-                )
-                for row in rows
-            ]
+
+            # host and content_type repeat on nearly every row; keep one str object per distinct value
+            interned: dict[str, str] = {}
+            for row in rows:
+                row['host'] = interned.setdefault(row['host'], row['host'])
+                if row['content_type'] is not None:
+                    row['content_type'] = interned.setdefault(row['content_type'], row['content_type'])
+
+            return _rows_response(rows)
 
 
 @app.get('/web/{job_and_mod}/{original_url:path}')
 async def web_wayback(job_and_mod: str, original_url: str):
     """Serve archived web pages and resources by job ID."""
-    # Parse job ID and modifier
-    if job_and_mod.isdigit():
-        job_id = int(job_and_mod)
-    else:
-        # Handle modifiers like 5im_, 5cs_, 5js_, etc.
-        match = re.match(r'(\d+)([a-z_]+)?', job_and_mod)
-        if not match:
-            raise HTTPException(status_code=400, detail='Invalid job ID/modifier')
-        job_id = int(match.group(1))
+    # Parse job ID; anything after the leading digits is a modifier like im_, cs_, js_
+    n = 0
+    while n < len(job_and_mod) and '0' <= job_and_mod[n] <= '9':
+        n += 1
+    if n == 0:
+        raise HTTPException(status_code=400, detail='Invalid job ID/modifier')
+    job_id = int(job_and_mod[:n])
 
     absolute_url = _normalize_absolute(unquote(original_url))
     parsed = urlsplit(absolute_url)
@@ -251,29 +341,24 @@ async def web_wayback(job_and_mod: str, original_url: str):
     if not host or not parsed.scheme:
         raise HTTPException(status_code=400, detail='URL must be absolute')
 
-    # Debug logging
-    print(f'Looking for job_id={job_id}, url={absolute_url}')
+    logger.debug('Looking for job_id=%s, url=%s', job_id, absolute_url)
 
     row = await _fetch_from_db(job_id, absolute_url)
     if not row:
-        # Try to find what URLs we do have for this job
-        async with pool.connection() as conn:
-            async with conn.cursor(row_factory=dict_row) as cur:
-                await cur.execute(SQL_DEBUG_QUERY, {'job_id': job_id})
-                available_urls = await cur.fetchall()
-                print(f'Available URLs for job {job_id}: {[r["link"] for r in available_urls]}')
-
         raise HTTPException(status_code=404, detail=f'Archived resource not found: {absolute_url}')
 
     raw = _normalize_bytes(row['content'])
     ctype = (row['content_type'] or '').lower()
 
+    # Send the stored Content-Type verbatim. Given as media_type, Starlette would append "; charset=utf-8"
+    # to a bare text/* type and override the page's own <meta charset>
+    headers = {'content-type': row['content_type'] or 'application/octet-stream'}
+
     if ctype.startswith('text/html'):
-        html = raw.decode('utf-8', errors='ignore')
-        rewritten = rewrite_links_in_html(html, host, job_id)
-        return Response(content=rewritten, media_type='text/html')
+        rewritten = await asyncio.to_thread(rewrite_links_in_html, bytes(raw), host, job_id)
+        return Response(content=rewritten, headers=headers)
 
-    return Response(content=raw, media_type=row['content_type'] or 'application/octet-stream')
+    return Response(content=raw, headers=headers)
 
 
 async def run_archive(pool: AsyncConnectionPool, url: str, max_pages: int, num_workers: int) -> None:
@@ -294,16 +379,18 @@ async def trigger_archive(request: ArchiveRequest):
     The job id is created inside BasicArchiver.run().
     """
     try:
-        loop = asyncio.get_running_loop()
-        loop.call_soon(
-            loop.create_task,
+        resource_cache.clear()
+
+        task = asyncio.create_task(
             run_archive(
                 pool,
                 str(request.url),
                 request.max_pages or 100,
                 request.num_workers or 10,
-            ),
+            )
         )
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
 
         return {
             'message': f'archive scheduled for {request.url}',
@@ -6,4 +6,5 @@ select
 from archived_resource ar
 join archive_jobs aj on ar.scraping_job = aj.id
 group by ar.host
-order by latest_job_time desc;
+order by latest_job_time desc
+limit %(limit)s offset %(offset)s;
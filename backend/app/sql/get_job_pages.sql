@@ -8,5 +8,6 @@ select
 from archived_resource
 where host = %(host)s
     and scraping_job = %(job_id)s
-    and content_type like %(ctx_type)s
-order by link;
+    and content_type like 'text/html%%'
+order by link
+limit %(limit)s offset %(offset)s;
@@ -4,6 +4,7 @@ select
     count(ar.id) as page_count
 from archive_jobs aj
 join archived_resource ar on aj.id = ar.scraping_job
-where ar.host = %(host)s and ar.content_type like %(ctx_type)s
+where ar.host = %(host)s and ar.content_type like 'text/html%%'
 group by aj.id, aj.time_started
-order by aj.time_started desc;
+order by aj.time_started desc
+limit %(limit)s offset %(offset)s;
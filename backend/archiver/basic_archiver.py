@@ -1,52 +1,100 @@
-import re
 import asyncio
+import threading
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
-from lxml import html as lxml_html
 from stealth_requests import AsyncStealthSession
+from psycopg import AsyncConnection
 from psycopg_pool import AsyncConnectionPool
 
+from .link_extractor import LinkExtractor
+from .rate_limiter import RateLimiter
 
-# CSS url(...) finder regex
-CSS_URL_RE = re.compile(r"url\(\s*(['\"]?)(?!data:)(?!about:)([^'\"\)]*)\1\s*\)", re.IGNORECASE)
 
 SQL_DIR = Path(__file__).parent / 'sql'
 SQL_INSERT_JOB = (SQL_DIR / 'insert_job.sql').read_text(encoding='utf-8')
 SQL_ARCHIVE_CONTENT = (SQL_DIR / 'archive_content.sql').read_text(encoding='utf-8')
 
+# Number of archived resources written to the database per round trip
+ARCHIVE_BATCH_SIZE = 50
+
+# Upper bound on the response bodies queued for, or being written to, the database
+DB_QUEUE_MAX_BYTES = 64 * 1024 * 1024
+
+# Responses larger than this are not downloaded or archived, so one huge video can't exhaust memory
+MAX_RESOURCE_BYTES = 50 * 1024 * 1024
+
+# HTML is fed to the parser in slices of this size, so elements are freed as the page is parsed
+PARSE_CHUNK_BYTES = 64 * 1024
+
+# URL schemes the crawler will follow
+HTTP_SCHEMES = frozenset({'http', 'https'})
+
 
 class BasicArchiver:
-    def __init__(self, pg_pool: AsyncConnectionPool, url: str, num_workers: int = 5, max_pages: int = 10):
+    def __init__(
+        self,
+        pg_pool: AsyncConnectionPool,
+        url: str,
+        num_workers: int = 5,
+        max_pages: int = 10,
+        requests_per_second: float | None = None,
+    ):
         """
         Args:
-            pg_pool: Psycopg connection pool instance
+            pg_pool: Psycopg connection pool instance whose connections return dict rows
             url: Starting URL to archive (determines allowed domain)
             num_workers: Number of concurrent workers for crawling
             max_pages: Maximum number of pages to archive
+            requests_per_second: Request rate allowed against the archived site, across all workers
+                (defaults to 10 per worker)
         """
         self.pg_pool = pg_pool
         self.num_workers = num_workers
         self.url = url
         self.max_pages = max_pages
+        if requests_per_second is None:
+            requests_per_second = 10.0 * num_workers
+        self.rate_limiter = RateLimiter(requests_per_second)
 
         self.url_queue: asyncio.Queue[str] = asyncio.Queue()
-        self.seen: set[str] = set()
-        self.total_links_seen = 0
+        # Bounded so crawling backs off if the database falls behind, instead of buffering every response body
+        self.db_queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=ARCHIVE_BATCH_SIZE * 2)
+        # Content bytes in db_queue plus the batch being written; the row cap alone would let
+        # ~100 large assets pile up, so archive_content also waits for this to drop under DB_QUEUE_MAX_BYTES
+        self.db_queue_bytes = 0
+        self._db_bytes_freed = asyncio.Condition()
+        # hash() of every URL ever queued. A 64-bit int per URL instead of the whole string keeps a large
+        # frontier small; at ~2**-64 per pair, a collision dropping a page isn't a practical concern
+        self.seen: set[int] = set()
+        self.total_pages_crawled = 0
+        # URLs queued or being fetched; each holds one slot of the max_pages budget until it turns out to be a page
+        self.pages_reserved = 0
         self.start_time = datetime.now()
-        self._seen_lock = asyncio.Lock()
         self._allowed_netloc = urllib.parse.urlparse(self.url).netloc.lower()
 
+        # HTML is parsed on these threads so a large page doesn't stall the event loop; lxml
+        # releases the GIL while parsing. Each thread keeps its own LinkExtractor in _parse_local
+        self._parse_executor = ThreadPoolExecutor(max_workers=min(4, num_workers), thread_name_prefix='parse')
+        self._parse_local = threading.local()
+
         self.job_id: int | None = None
         self.session: AsyncStealthSession | None = None
 
     def same_domain(self, u: str) -> bool:
         """
         Check if a URL belongs to the same domain as the initial URL.
+
+        Runs for every discovered link, so the scheme and netloc are sliced out with
+        plain string operations rather than a full urlparse.
         """
-        p = urllib.parse.urlparse(u)
-        return p.scheme in {'http', 'https'} and p.netloc.lower() == self._allowed_netloc
+        scheme, sep, rest = u.partition('://')
+        if not sep or scheme.lower() not in HTTP_SCHEMES:
+            return False
+        netloc = rest.partition('/')[0].partition('?')[0].partition('#')[0]
+        return netloc.lower() == self._allowed_netloc
 
     @staticmethod
     def abs_url(base: str, u: str | None) -> str | None:
@@ -79,26 +127,40 @@ class BasicArchiver:
     async def run(self) -> None:
         """
         Start the archiving process.
-        """
-        async with self.pg_pool.connection() as conn:
-            async with conn.cursor() as cur:
-                # create a new archive job and return its id
-                await cur.execute(SQL_INSERT_JOB)
-                row = await cur.fetchone()
-                self.job_id = row[0]  # save job id on the instance
-
-        # Seed the queue so workers have something to do
-        await self.put_todo(self.url)
-
-        async with AsyncStealthSession() as session:
-            self.session = session
 
-            workers = [asyncio.create_task(self.worker()) for _ in range(self.num_workers)]
-            await self.url_queue.join()
-
-            for worker in workers:
-                worker.cancel()
-            await asyncio.gather(*workers, return_exceptions=True)
+        The job is created on a short-lived connection; db_flusher then checks out its
+        own connection and holds it for the rest of the crawl.
+        """
+        try:
+            async with self.pg_pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    # create a new archive job and return its id
+                    await cur.execute(SQL_INSERT_JOB)
+                    row = await cur.fetchone()
+                    self.job_id = row['id']  # save job id on the instance
+                await conn.commit()  # make the job visible before any of its resources land
+
+            # Seed the queue so workers have something to do
+            self.seen.add(hash(self.url))
+            await self.put_todo(self.url)
+
+            async with AsyncStealthSession() as session:
+                self.session = session
+
+                flusher = asyncio.create_task(self.db_flusher())
+                workers = [asyncio.create_task(self.worker()) for _ in range(self.num_workers)]
+                await self.url_queue.join()
+
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+                # Wait for the last batch to be written before shutting the flusher down
+                await self.db_queue.join()
+                flusher.cancel()
+                await asyncio.gather(flusher, return_exceptions=True)
+        finally:
+            self._parse_executor.shutdown(wait=False)
 
     async def worker(self) -> None:
         while True:
@@ -123,43 +185,87 @@ class BasicArchiver:
         Args:
             url: The URL to crawl
         """
-        await asyncio.sleep(0.1)
-
-        resp = await self.session.get(url)
-
-        final_url = str(resp.url)
-        if not self.same_domain(final_url):
-            return
+        resp = None
+        counted = False
+        try:
+            await self.rate_limiter.acquire()
+            resp = await self.session.get(url, stream=True)
 
-        print(f'Crawled page: {url} - Status code: {resp.status_code}')
+            final_url = str(resp.url)
+            if not self.same_domain(final_url):
+                return
 
-        ctype = (resp.headers.get('content-type') or '').lower()
-        is_html = 'text/html' in ctype and resp.status_code == 200
+            # Skip oversized resources from the headers alone, before any of the body is read
+            length = resp.headers.get('content-length') or ''
+            if length.isdigit() and int(length) > MAX_RESOURCE_BYTES:
+                print(f'Skipped page: {url} - {length} bytes is over the size limit')
+                return
 
-        if is_html:
-            pages, assets = await self.parse_links(base=final_url, text=resp.text or '')
+            print(f'Crawled page: {url} - Status code: {resp.status_code}')
+
+            if resp.status_code == 200:
+                # Turn the slot put_todo reserved for this URL into a crawled page
+                self.pages_reserved -= 1
+                self.total_pages_crawled += 1
+                counted = True
+
+            ctype = (resp.headers.get('content-type') or '').lower()
+            is_html = 'text/html' in ctype and resp.status_code == 200
+
+            # Once the page budget is spent nothing found here would be queued, so don't parse at all
+            want_links = is_html and self.budget_left()
+
+            chunks: list[bytes] = []
+            size = 0
+            async for chunk in resp.aiter_content():
+                # Servers don't always send Content-Length, so enforce the limit while streaming too
+                size += len(chunk)
+                if size > MAX_RESOURCE_BYTES:
+                    print(f'Skipped page: {url} - body is over the size limit')
+                    return
+                chunks.append(chunk)
+            content = b''.join(chunks)
+            del chunks  # don't keep a second copy of the body alive until crawl() returns
+        finally:
+            if not counted:
+                # Not a page after all (error, non-200, skipped), so hand its slot back
+                self.pages_reserved -= 1
+            if resp is not None:
+                await resp.aclose()
+
+        if want_links:
+            # The raw bytes go straight to lxml's C parser, with the header's charset (if any) as the encoding
+            charset = ctype.partition('charset=')[2].partition(';')[0].strip(' "\'') or None
+            loop = asyncio.get_running_loop()
+            pages, assets = await loop.run_in_executor(
+                self._parse_executor, self.extract_links, final_url, charset, content
+            )
             await self.on_found_links(pages | assets)
 
-        await self.archive_content(resp, source_url=final_url)
+        # Both the requested and the final URL passed same_domain(), so the host is always the allowed netloc
+        await self.archive_content(resp, content, source_url=final_url, host=self._allowed_netloc)
 
-    async def archive_content(self, resp, source_url: str) -> None:
+    async def archive_content(self, resp, content: bytes, source_url: str, host: str) -> None:
         """
         Store the response content in the database.
 
         Args:
-            resp: HTTP response object containing headers, content, etc.
+            resp: HTTP response object containing headers, status code, etc.
+            content: Response body, read from the stream by crawl()
             source_url: Original URL that was requested
+            host: Lowercased netloc of the archived URL, already known from the same-domain check
 
-        Extracts response data and inserts it into the archived_resource table
-        associated with the current archive job.
+        Extracts response data and queues it for insertion into the archived_resource
+        table (associated with the current archive job) by db_flusher. Waits while the
+        bodies already waiting to be written add up to DB_QUEUE_MAX_BYTES; a body is
+        always admitted when nothing is pending, so one oversized resource can't stall.
         """
         headers = resp.headers or {}
-        content = resp.content
         link = resp.request.url or source_url
 
         params = {
             'link': link,
-            'host': urllib.parse.urlparse(link).netloc.lower(),
+            'host': host,
             'status_code': resp.status_code,
             'content_type': headers.get('content-type'),
             'content': content,
@@ -167,88 +273,121 @@ class BasicArchiver:
             'scraping_job': self.job_id,
         }
 
-        async with self.pg_pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(SQL_ARCHIVE_CONTENT, params)
-                _row = await cur.fetchone()  # id if you want it
+        size = len(content)
+        async with self._db_bytes_freed:
+            await self._db_bytes_freed.wait_for(
+                lambda: self.db_queue_bytes == 0 or self.db_queue_bytes + size <= DB_QUEUE_MAX_BYTES
+            )
+            self.db_queue_bytes += size
+
+        await self.db_queue.put(params)
+
+    async def db_flusher(self) -> None:
+        """
+        Drain db_queue and insert archived resources in batches.
+
+        Waits for at least one queued row, then takes whatever else is already waiting
+        (up to ARCHIVE_BATCH_SIZE) and writes it with write_batch. Each batch is committed
+        on its own so archived pages show up while the crawl is still running.
 
-    async def parse_links(self, base: str, text: str) -> tuple[set[str], set[str]]:
+        One pooled connection is checked out and kept for the whole crawl, so inserts
+        don't pay for a pool checkout each. If that connection is lost (server restart,
+        idle kill, network blip) it is handed back to the pool, which discards it, and
+        the rest of the batch is retried once on a fresh connection. A batch that still
+        can't be written is dropped, so db_queue always drains and run() can finish.
         """
-        Parse HTML content and extract all links to pages and assets.
+        conn: AsyncConnection | None = None
+        try:
+            while True:
+                batch = [await self.db_queue.get()]
+                while len(batch) < ARCHIVE_BATCH_SIZE and not self.db_queue.empty():
+                    batch.append(self.db_queue.get_nowait())
+                size = len(batch)
+                nbytes = sum(params['content_length'] for params in batch)
+
+                try:
+                    for _attempt in range(2):
+                        try:
+                            if conn is None:
+                                conn = await self.pg_pool.getconn()
+                            await self.write_batch(conn, batch)
+                            break
+                        except Exception as exc:
+                            print(exc)
+                            if conn is not None:
+                                await self.pg_pool.putconn(conn)
+                                conn = None
+                finally:
+                    async with self._db_bytes_freed:
+                        self.db_queue_bytes -= nbytes
+                        self._db_bytes_freed.notify_all()
+                    for _ in range(size):
+                        self.db_queue.task_done()
+        finally:
+            if conn is not None:
+                await self.pg_pool.putconn(conn)
+
+    async def write_batch(self, conn: AsyncConnection, batch: list[dict]) -> None:
+        """
+        Insert a batch of archived resources and commit it.
+
+        Args:
+            conn: Connection to write on
+            batch: Insert parameters, one dict per archived resource. Rows are removed
+                as they are committed (or given up on), so whatever is left after an
+                exception still has to be written
+
+        If the batch insert fails it is rolled back and the rows are retried one at a
+        time, so a bad row only loses itself instead of the whole batch. Errors that
+        leave the connection unusable are raised for db_flusher to handle.
+        """
+        async with conn.cursor() as cur:
+            try:
+                await cur.executemany(SQL_ARCHIVE_CONTENT, batch)
+                await conn.commit()
+                batch.clear()
+                return
+            except Exception as exc:
+                if conn.broken:
+                    raise
+                print(exc)
+                await conn.rollback()
+
+            while batch:
+                try:
+                    await cur.execute(SQL_ARCHIVE_CONTENT, batch[0])
+                    await conn.commit()
+                except Exception as exc:
+                    if conn.broken:
+                        raise
+                    print(exc)
+                    await conn.rollback()
+                del batch[0]
+
+    def extract_links(self, base: str, encoding: str | None, content: bytes) -> tuple[set[str], set[str]]:
+        """
+        Parse an HTML page and return its same-domain links. Runs on a parse thread.
 
         Args:
             base: Base URL for resolving relative links
-            text: HTML content to parse
+            encoding: Charset from the Content-Type header, if any
+            content: Response body
 
         Returns:
-            Tuple of (page_links, asset_links) where both are sets of absolute URLs
-            from the same domain. Pages are from <a> tags, assets are from <img>,
-            <script>, <link>, CSS url(), srcset attributes, etc.
+            Tuple of (page_links, asset_links), see LinkExtractor.close()
 
-        Uses lxml to parse HTML and extract links from various elements and attributes.
-        Filters out data: URIs, fragments, and off-domain links.
+        Every thread reuses one extractor, so lxml parsers never move between threads.
+        The body is fed in PARSE_CHUNK_BYTES slices so elements are freed as the page is
+        parsed (lxml's feed() doesn't take memoryviews, so each slice is a short-lived copy).
         """
-        pages: set[str] = set()
-        assets: set[str] = set()
+        links = getattr(self._parse_local, 'links', None)
+        if links is None:
+            links = self._parse_local.links = LinkExtractor(self.same_domain)
 
-        try:
-            doc = lxml_html.fromstring(text or '')
-        except Exception:
-            return pages, assets
-
-        # Make relative links absolute (respects <base href> if present)
-        doc.make_links_absolute(base, resolve_base_href=True)
-
-        # 1) Page links (<a href>)
-        for el in doc.xpath('//a[@href]'):
-            u = self.abs_url(base, el.get('href'))
-            if u and self.same_domain(u):
-                pages.add(u)
-
-        # 2) Asset links
-        # img/src, poster, script/src, iframe/src, embed/src, audio/src, video/src, source/src, track/src
-        asset_xpaths = [
-            (
-                'src',
-                '//img[@src] | //script[@src] | //iframe[@src] | //embed[@src] | //audio[@src] | //video[@src] | //source[@src] | //track[@src]',
-            ),
-            ('poster', '//video[@poster]'),
-            ('href', '//link[@href]'),  # stylesheets, icons, preloads, etc.
-        ]
-        for attr, xp in asset_xpaths:
-            for el in doc.xpath(xp):
-                u = self.abs_url(base, el.get(attr))
-                if u and self.same_domain(u):
-                    assets.add(u)
-
-        # 3) srcset (img/source)
-        for el in doc.xpath('//img[@srcset] | //source[@srcset]'):
-            srcset = el.get('srcset') or ''
-            for cand in srcset.split(','):
-                part = cand.strip().split()[0] if cand.strip() else ''
-                u = self.abs_url(base, part)
-                if u and self.same_domain(u):
-                    assets.add(u)
-
-        # 4) Inline style attributes: url(...)
-        for el in doc.xpath('//*[@style]'):
-            style_val = el.get('style') or ''
-            for m in CSS_URL_RE.finditer(style_val):
-                u = self.abs_url(base, m.group(2).strip())
-                if u and self.same_domain(u):
-                    assets.add(u)
-
-        # 5) <style> blocks: url(...)
-        for el in doc.xpath('//style'):
-            css_text = el.text or ''
-            for m in CSS_URL_RE.finditer(css_text):
-                u = self.abs_url(base, m.group(2).strip())
-                if u and self.same_domain(u):
-                    assets.add(u)
-
-        # Ensure assets aren't crawled as pages
-        assets -= pages
-        return pages, assets
+        links.start(base, encoding=encoding)
+        for start in range(0, len(content), PARSE_CHUNK_BYTES):
+            links.feed(content[start : start + PARSE_CHUNK_BYTES])
+        return links.close()
 
     async def on_found_links(self, urls: set[str]) -> None:
         """
@@ -257,14 +396,19 @@ class BasicArchiver:
         Args:
             urls: Set of absolute URLs discovered during parsing
 
-        Uses a lock to prevent race conditions when multiple workers discover
-        the same URLs simultaneously. Only adds URLs that haven't been seen before.
+        Stops as soon as the max_pages budget is used up, before marking the remaining
+        URLs as seen, so they can still be queued if a reserved slot is handed back.
+        Only adds URLs that haven't been seen before. No lock is needed: there is no
+        await between the membership check and the add, so no other worker can run
+        in between.
         """
-        async with self._seen_lock:
-            new = urls - self.seen
-            self.seen.update(new)
-
-        for u in new:
+        for u in urls:
+            if not self.budget_left():
+                return
+            key = hash(u)
+            if key in self.seen:
+                continue
+            self.seen.add(key)
             await self.put_todo(u)
 
     async def put_todo(self, url: str) -> None:
@@ -274,15 +418,18 @@ class BasicArchiver:
         Args:
             url: URL to potentially add to the queue
 
-        Checks if the URL is valid (http/https, same domain) and if we haven't
-        exceeded the max_pages limit before adding it to the queue.
+        Checks if the URL is valid (http/https, same domain) and if the budget has
+        room for it, then reserves a slot for it and adds it to the queue.
         """
-        if self.total_links_seen >= self.max_pages:
+        if not self.budget_left():
             return
 
-        p = urllib.parse.urlparse(url)
-        if p.scheme not in {'http', 'https'} or not self.same_domain(url):
+        if not self.same_domain(url):
             return
 
-        self.total_links_seen += 1
+        self.pages_reserved += 1
         await self.url_queue.put(url)
+
+    def budget_left(self) -> bool:
+        """Whether pages crawled plus URLs queued or in flight are still under max_pages."""
+        return self.total_pages_crawled + self.pages_reserved < self.max_pages
@@ -0,0 +1,146 @@
+import urllib.parse
+from collections.abc import Callable
+
+from lxml import etree
+from lxml import html as lxml_html
+
+# iterlinks() attributes the crawler follows: href/src, inline style url() ("style") and <style> blocks (None).
+# Everything else it reports (form action, cite, meta refresh, object data/codebase, ...) isn't fetched, since
+# a GET on e.g. a form's /logout action has side effects
+FOLLOWED_LINK_ATTRS = frozenset({'href', 'src', 'style', None})
+
+# Elements whose href is a page to crawl rather than an asset
+PAGE_LINK_TAGS = frozenset({'a', 'area'})
+
+
+class LinkExtractor:
+    def __init__(self, keep: Callable[[str], bool]):
+        """
+        Incrementally parse HTML pages and collect the links in them.
+
+        Args:
+            keep: Predicate deciding whether an absolute URL should be collected (e.g. same domain)
+
+        Each element is handled as soon as its end tag is parsed and is then cleared
+        and detached from the tree, so memory stays bounded by the element being
+        processed instead of growing with the whole document.
+
+        One extractor is meant to be reused for page after page (one per parse thread):
+        lxml parsers reset themselves on close(), so the parser for each encoding is
+        built once instead of once per page.
+        """
+        self.keep = keep
+        self.base = ''
+        self.pages: set[str] = set()
+        self.assets: set[str] = set()
+
+        self._base_resolved = False
+        self._parsers: dict[str | None, etree.HTMLPullParser] = {}
+        self._parser: etree.HTMLPullParser | None = None
+
+    def start(self, base: str, encoding: str | None = None) -> None:
+        """
+        Begin a new page.
+
+        Args:
+            base: URL the page was fetched from, used to resolve relative links
+            encoding: Charset from the Content-Type header, if any. Without one lxml detects it from the bytes
+        """
+        if self._parser is not None:
+            # The previous page was abandoned halfway (error or size limit), throw away what it left behind
+            for _ in self._finish():
+                pass
+
+        self.base = base
+        self.pages = set()
+        self.assets = set()
+        self._base_resolved = False
+
+        parser = self._parsers.get(encoding)
+        if parser is None:
+            parser = self._parsers[encoding] = self._new_parser(encoding)
+        self._parser = parser
+
+    def feed(self, data: bytes) -> None:
+        """Parse the next chunk of the page and handle every element it closed."""
+        self._parser.feed(data)
+        self._drain(self._parser.read_events())
+
+    def close(self) -> tuple[set[str], set[str]]:
+        """
+        Finish parsing the current page and return what was collected.
+
+        Returns:
+            Tuple of (page_links, asset_links). Pages are from <a> and <area> tags, assets are from
+            <img>, <script>, <link>, CSS url(), srcset attributes, etc.
+        """
+        self._drain(self._finish())
+
+        # Ensure assets aren't crawled as pages
+        self.assets -= self.pages
+        return self.pages, self.assets
+
+    @staticmethod
+    def _new_parser(encoding: str | None) -> etree.HTMLPullParser:
+        try:
+            parser = etree.HTMLPullParser(events=('end',), encoding=encoding)
+        except LookupError:
+            # Charset the server sent isn't one lxml knows, so let it sniff the bytes instead
+            parser = etree.HTMLPullParser(events=('end',))
+        return parser
+
+    def _finish(self):
+        """Close the current parser, ready for reuse, and return the events close() produced."""
+        parser, self._parser = self._parser, None
+        try:
+            parser.close()
+        except etree.XMLSyntaxError:
+            # Nothing was fed (empty body)
+            pass
+        return parser.read_events()
+
+    def _drain(self, events) -> None:
+        for _event, el in events:
+            if el.tag == 'base' and not self._base_resolved:
+                href = el.get('href')
+                if href:
+                    self.base = urllib.parse.urljoin(self.base, href)
+                    self._base_resolved = True
+            else:
+                self._collect(el)
+
+            # Free the element and everything before it; it has been fully handled
+            el.clear(keep_tail=True)
+            parent = el.getparent()
+            if parent is not None:
+                while el.getprevious() is not None:
+                    del parent[0]
+
+    def _collect(self, el: etree._Element) -> None:
+        # Children were already cleared when their own end tags were handled,
+        # so iterlinks() only sees this element's attributes and text.
+        # Called through HtmlMixin because a reused parser hands out plain elements:
+        # lxml drops the parser's HtmlElement class lookup after its first close()
+        for link_el, attr, link, _pos in lxml_html.HtmlMixin.iterlinks(el):
+            if link_el is not el or attr not in FOLLOWED_LINK_ATTRS:
+                continue
+            if attr == 'href' and el.tag in PAGE_LINK_TAGS:
+                self._add(self.pages, link)
+            else:
+                self._add(self.assets, link)
+
+        # srcset and poster, which iterlinks() doesn't know about
+        srcset = el.get('srcset')
+        if srcset and el.tag in ('img', 'source'):
+            for cand in srcset.split(','):
+                if cand.strip():
+                    self._add(self.assets, cand.split()[0])
+
+        poster = el.get('poster')
+        if poster and el.tag == 'video':
+            self._add(self.assets, poster)
+
+    def _add(self, found: set[str], link: str) -> None:
+        u = urllib.parse.urldefrag(urllib.parse.urljoin(self.base, link.strip()))[0]
+        if u and self.keep(u):
+            found.add(u)
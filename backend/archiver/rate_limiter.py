@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int | None = None):
+        """
+        Token bucket shared by all workers of a crawl.
+
+        Args:
+            rate: Requests allowed per second
+            burst: Requests that may go out back to back after an idle period (defaults to rate, at least 1)
+        """
+        if rate <= 0:
+            raise ValueError(f'rate must be positive, got {rate}')
+
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Wait until a request is allowed.
+
+        Callers only sleep when the bucket is empty, and they are served in arrival order.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
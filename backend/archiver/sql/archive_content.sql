@@ -12,8 +12,7 @@ values (
     %(host)s,
     %(status_code)s,
     %(content_type)s,
-    %(content)s,
+    %(content)b,
     %(content_length)s,
     %(scraping_job)s
-)
-returning id;
+);
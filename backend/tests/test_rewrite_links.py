@@ -0,0 +1,66 @@
+import os
+import time
+import unittest
+
+os.environ.setdefault('PG_URI', 'postgresql://localhost/test')
+
+from app.main import rewrite_links_in_html  # noqa: E402
+
+HOST = 'example.com'
+JOB_ID = 5
+
+
+def rewrite(html: bytes) -> bytes:
+    return rewrite_links_in_html(html, HOST, JOB_ID)
+
+
+class RewriteLinksTest(unittest.TestCase):
+    def test_rewrites_link_tags(self):
+        html = b'<a href="/y">y</a><img src=/i.png><link rel=stylesheet href=\'s.css\'><script src="/a.js"></script>'
+        self.assertEqual(
+            rewrite(html),
+            b'<a href="/api/web/5/https%3A%2F%2Fexample.com%2Fy">y</a>'
+            b'<img src="/api/web/5im_/https%3A%2F%2Fexample.com%2Fi.png">'
+            b"<link rel=stylesheet href='/api/web/5cs_/https%3A%2F%2Fexample.com%2Fs.css'>"
+            b'<script src="/api/web/5js_/https%3A%2F%2Fexample.com%2Fa.js"></script>',
+        )
+
+    def test_leaves_other_hosts_and_fragments(self):
+        html = b'<a href="https://other.org/x">x</a><a href="#top">top</a><img alt="no src">'
+        self.assertEqual(rewrite(html), html)
+
+    def test_leaves_inline_script_bodies(self):
+        html = (
+            b"<script>el.innerHTML = '<img src=\"' + url + '\">';</script>"
+            b'<SCRIPT type="module">var s = "<a href=/js>";</SCRIPT >'
+        )
+        self.assertEqual(rewrite(html), html)
+
+    def test_rewrites_script_start_tag_only(self):
+        html = b'<script src="/a.js">document.write("<img src=/b.png>")</script>'
+        self.assertEqual(
+            rewrite(html),
+            b'<script src="/api/web/5js_/https%3A%2F%2Fexample.com%2Fa.js">document.write("<img src=/b.png>")</script>',
+        )
+
+    def test_leaves_comments_and_style_blocks(self):
+        html = b'<!-- <a href="/x"> --><style>a{background:url(/b.png)} /* <img src=x> */</style>'
+        self.assertEqual(rewrite(html), html)
+
+    def test_markup_after_raw_text_is_rewritten(self):
+        html = b'<style>p{}</style><!-- c --><script>1</script><a href=/q>'
+        self.assertTrue(rewrite(html).endswith(b'<a href="/api/web/5/https%3A%2F%2Fexample.com%2Fq">'))
+
+    def test_unterminated_raw_text_runs_to_end(self):
+        for html in (b'<script>x <a href=/n>', b'<!-- open <a href=/c>'):
+            self.assertEqual(rewrite(html), html)
+
+    def test_unterminated_quotes_are_linear(self):
+        html = b'<a title="x' * 50_000
+        start = time.perf_counter()
+        self.assertEqual(rewrite(html), html)
+        self.assertLess(time.perf_counter() - start, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
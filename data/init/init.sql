@@ -14,3 +14,9 @@ create table if not exists archived_resource (
     scraping_job bigint not null references archive_jobs(id) on delete cascade
 );
 
+-- Archived resource lookups by job and URL (replay path)
+create index if not exists archived_resource_job_link_idx on archived_resource (scraping_job, link);
+
+-- Page listings only ever look at HTML rows
+create index if not exists archived_resource_html_idx on archived_resource (host, scraping_job)
+    where content_type like 'text/html%';